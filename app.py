@@ -1,17 +1,54 @@
+import hashlib
+
+import numpy as np
 import streamlit as st
 import pandas as pd
-import plotly.express as px
+import plotly.graph_objects as go
 from scraper import get_all_bills, load_config
 
 # --- 页面配置 ---
 st.set_page_config(page_title="校园一卡通消费分析", page_icon="💳", layout="wide")
 
 # --- 核心数据处理与分析函数 ---
+class BillLoadError(Exception):
+    """账单获取失败（网络错误、部分页面失败或 Cookie 失效），抛出异常以避免失败结果被缓存"""
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _load_bills(cookie_hash, start, end):
+    """按 (Cookie 摘要, 起止日期) 缓存账单数据，重复查询无需再次抓取"""
+    # 任何一页获取失败都视为失败，避免把不完整的数据缓存一小时
+    result = get_all_bills(st.session_state.config, start, end, skip_failed_pages=False)
+    if not isinstance(result, pd.DataFrame):
+        raise BillLoadError(result)
+    return result
+
+@st.cache_data(ttl=3600)
+def compute_aggregates(cookie_hash, start, end, _df):
+    """
+    预先计算图表所需的聚合结果，页面重绘时直接命中缓存。
+    与 _load_bills 使用相同的缓存键，_df 以下划线开头因而不参与哈希。
+    """
+    # 按月份 Period 分组求和，补齐没有消费的月份，效果等同于 resample 但开销更小
+    monthly = _df.groupby(_df['交易时间'].dt.to_period('M'))['消费金额(元)'].sum()
+    monthly = monthly.reindex(pd.period_range(monthly.index.min(), monthly.index.max(), freq='M'), fill_value=0)
+    df_monthly = monthly.rename_axis('交易时间').reset_index()
+    df_monthly['交易时间'] = df_monthly['交易时间'].dt.to_timestamp()
+    return {
+        'monthly': df_monthly,
+        'hourly': _df['小时'].value_counts().sort_index(),
+        'weekly': _df.groupby('星期', sort=True)['消费金额(元)'].sum().reindex(range(7), fill_value=0),
+    }
+
 def run_analysis(start_date, end_date):
     """根据日期范围加载数据并执行所有分析和图表渲染"""
     try:
         with st.spinner(f"正在获取 {start_date} 到 {end_date} 的账单数据..."):
-            result = get_all_bills(st.session_state.config, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+            cookie_hash = hashlib.md5(st.session_state.config['cookie'].encode()).hexdigest()
+            start, end = start_date.isoformat(), end_date.isoformat()
+            try:
+                result = _load_bills(cookie_hash, start, end)
+            except BillLoadError as e:
+                result = e.args[0]
 
         # 首先检查返回的是否为 DataFrame，如果不是，则说明是错误信息
         if not isinstance(result, pd.DataFrame):
@@ -35,29 +72,33 @@ def run_analysis(start_date, end_date):
             st.warning("在选定时间范围内没有找到任何账单记录。")
             return
 
-        # --- 数据类型强制转换 (防御性编程) ---
-        df['交易金额(元)'] = pd.to_numeric(df['交易金额(元)'], errors='coerce')
-        df['交易时间'] = pd.to_datetime(df['交易时间'], errors='coerce')
-        df.dropna(subset=['交易金额(元)', '交易时间'], inplace=True)
-
         # --- 数据筛选与预处理：只保留支出项 ---
-        df_expenses = df[df['交易内容'] == '消费'].copy()
-        
-        if df_expenses.empty:
+        # 交易内容由 scraper 以分类类型返回，直接按整数编码筛选，只取出分析所需的两列构建新表，避免整表复制
+        categories = df['交易内容'].cat.categories
+        if '消费' in categories:
+            mask = df['交易内容'].cat.codes.to_numpy() == categories.get_loc('消费')
+        else:
+            mask = np.zeros(len(df), dtype=bool)
+
+        if not mask.any():
             st.success("数据加载完毕！")
             st.warning("在选定时间范围内没有找到任何【消费】记录，所有分析图表将为空。")
             return
 
         # 将交易金额转为正数，便于计算
-        df_expenses['消费金额(元)'] = df_expenses['交易金额(元)'].abs()
-        df_expenses['小时'] = df_expenses['交易时间'].dt.hour
-        df_expenses['星期'] = df_expenses['交易时间'].dt.day_name()
+        df_expenses = pd.DataFrame({
+            '交易时间': df['交易时间'].to_numpy()[mask],
+            '消费金额(元)': np.abs(df['交易金额(元)'].to_numpy()[mask]),
+        })
+        df_expenses['小时'] = df_expenses['交易时间'].dt.hour.astype('int8')
+        # 以整数 (0=周一) 存储星期，仅在绘图时映射为名称
+        df_expenses['星期'] = df_expenses['交易时间'].dt.dayofweek.astype('int8')
 
         st.success("数据加载与处理完毕！")
         
         # --- 渲染分析模块 ---
         render_summary_metrics(df_expenses)
-        render_charts(df_expenses)
+        render_charts(compute_aggregates(cookie_hash, start, end, df_expenses))
         render_fun_facts(df_expenses)
 
     except Exception as e:
@@ -66,25 +107,26 @@ def run_analysis(start_date, end_date):
 def render_summary_metrics(df):
     """渲染顶部的核心指标"""
     st.header("📈 消费总览")
-    total_expense = df['消费金额(元)'].sum()
+    amounts = df['消费金额(元)'].to_numpy()
+    total_expense = amounts.sum()
     days_span = (df['交易时间'].max() - df['交易时间'].min()).days + 1
     avg_daily_expense = total_expense / days_span if days_span > 0 else 0
     
     col1, col2, col3 = st.columns(3)
     col1.metric("总支出", f"¥ {total_expense:,.2f}")
     col2.metric("日均消费", f"¥ {avg_daily_expense:,.2f}")
-    col3.metric("总消费次数", f"{len(df)} 笔")
+    col3.metric("总消费次数", f"{len(amounts)} 笔")
 
-def render_charts(df):
+def render_charts(aggregates):
     """渲染所有数据图表"""
     st.header("📊 图表分析")
 
     # --- 月度消费趋势 ---
     st.subheader("月度消费趋势")
-    # 使用 'ME' (Month End) 替代已弃用的 'M'
-    df_monthly = df.set_index('交易时间').resample('ME').agg({'消费金额(元)': 'sum'}).reset_index()
-    fig_monthly = px.line(df_monthly, x='交易时间', y='消费金额(元)', title="每月总支出变化", markers=True, labels={'交易时间':'月份', '消费金额(元)':'消费总额(元)'})
-    fig_monthly.update_layout(title_x=0.5)
+    df_monthly = aggregates['monthly']
+    # 直接构建 WebGL 图形对象，跳过 plotly.express 的 DataFrame 解析；uirevision 保证重绘时不重置交互状态
+    fig_monthly = go.Figure(go.Scattergl(x=df_monthly['交易时间'], y=df_monthly['消费金额(元)'], mode='lines+markers'))
+    fig_monthly.update_layout(title="每月总支出变化", title_x=0.5, xaxis_title="月份", yaxis_title="消费总额(元)", uirevision='static')
     st.plotly_chart(fig_monthly, use_container_width=True)
 
     col1, col2 = st.columns(2)
@@ -92,18 +134,18 @@ def render_charts(df):
     with col1:
         # --- 干饭能量分布图 ---
         st.subheader("干饭能量分布")
-        hourly_counts = df['小时'].value_counts().sort_index()
-        fig_hourly = px.bar(hourly_counts, x=hourly_counts.index, y=hourly_counts.values, title="一天中的消费高频时段", labels={'index':'小时', 'y':'消费次数'})
-        fig_hourly.update_layout(title_x=0.5, xaxis_title="小时（24小时制）", yaxis_title="消费笔数")
+        hourly_counts = aggregates['hourly']
+        fig_hourly = go.Figure(go.Bar(x=hourly_counts.index, y=hourly_counts.values))
+        fig_hourly.update_layout(title="一天中的消费高频时段", title_x=0.5, xaxis_title="小时（24小时制）", yaxis_title="消费笔数", uirevision='static')
         st.plotly_chart(fig_hourly, use_container_width=True)
 
     with col2:
         # --- 一周消费热力图 ---
         st.subheader("一周消费热力图")
-        days_order = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-        weekly_spending = df.groupby('星期')['消费金额(元)'].sum().reindex(days_order)
-        fig_weekly = px.bar(weekly_spending, x=weekly_spending.index, y=weekly_spending.values, title="周消费习惯分析", labels={'index':'星期', 'y':'消费总额(元)'})
-        fig_weekly.update_layout(title_x=0.5, xaxis_title="星期", yaxis_title="消费总额(元)")
+        weekly_spending = aggregates['weekly']
+        weekday_labels = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+        fig_weekly = go.Figure(go.Bar(x=weekday_labels, y=weekly_spending.values))
+        fig_weekly.update_layout(title="周消费习惯分析", title_x=0.5, xaxis_title="星期", yaxis_title="消费总额(元)", uirevision='static')
         st.plotly_chart(fig_weekly, use_container_width=True)
 
 def render_fun_facts(df):
@@ -112,28 +154,41 @@ def render_fun_facts(df):
     
     col1, col2, col3 = st.columns(3)
 
+    # 一次性取出底层数组，用掩码 + argmin/argmax 定位记录，避免生成 DataFrame 子集和逐行取值
+    hours = df['小时'].to_numpy()
+    times = df['交易时间'].to_numpy()
+    amounts = df['消费金额(元)'].to_numpy()
+    mask_morning = (hours >= 5) & (hours <= 9) # 假设早餐时间 5-9点
+    mask_evening = (hours >= 18) & (hours <= 23) # 假设晚餐/夜宵 18-23点
+
+    # 在掩码子集内取 argmin/argmax，再映射回原始行号
+    earliest_idx = np.flatnonzero(mask_morning)[times[mask_morning].argmin()] if mask_morning.any() else None
+    latest_idx = np.flatnonzero(mask_evening)[times[mask_evening].argmax()] if mask_evening.any() else None
+    biggest_idx = np.argmax(amounts)
+
+    # 三个时间点一次性格式化为日期和时刻两部分，缺失的记录以 NaT 占位
+    interesting_times = np.array(
+        [times[i] if i is not None else np.datetime64('NaT') for i in (earliest_idx, latest_idx, biggest_idx)],
+        dtype='datetime64[ns]',
+    )
+    formatted = pd.Series(interesting_times).dt
+    earliest_date, latest_date, biggest_date = formatted.strftime('%Y-%m-%d').tolist()
+    earliest_clock, latest_clock, _ = formatted.strftime('%H:%M:%S').tolist()
+
     # --- 卷王时刻 ---
-    df_morning = df[df['小时'].between(5, 9)] # 假设早餐时间 5-9点
-    if not df_morning.empty:
-        earliest_record = df_morning.loc[df_morning['交易时间'].idxmin()]
-        earliest_time_str = earliest_record['交易时间'].strftime('%Y-%m-%d %H:%M:%S')
-        col1.metric("🥇 卷王时刻", earliest_record['交易时间'].strftime('%H:%M:%S'), help=f"记录于 {earliest_time_str}，又是为梦想早起的一天！")
+    if earliest_idx is not None:
+        col1.metric("🥇 卷王时刻", earliest_clock, help=f"记录于 {earliest_date} {earliest_clock}，又是为梦想早起的一天！")
     else:
         col1.metric("🥇 卷王时刻", "暂无记录", help="看起来您是个从容不迫的早餐享用者。")
 
     # --- 夜食之神 ---
-    df_evening = df[df['小时'].between(18, 23)] # 假设晚餐/夜宵 18-23点
-    if not df_evening.empty:
-        latest_record = df_evening.loc[df_evening['交易时间'].idxmax()]
-        latest_time_str = latest_record['交易时间'].strftime('%Y-%m-%d %H:%M:%S')
-        col2.metric("🌙 夜食之神", latest_record['交易时间'].strftime('%H:%M:%S'), help=f"记录于 {latest_time_str}，是知识的海洋让你忘记了时间吗？")
+    if latest_idx is not None:
+        col2.metric("🌙 夜食之神", latest_clock, help=f"记录于 {latest_date} {latest_clock}，是知识的海洋让你忘记了时间吗？")
     else:
         col2.metric("🌙 夜食之神", "暂无记录", help="看来您的作息相当规律，值得点赞！")
 
     # --- 豪横瞬间 ---
-    biggest_purchase = df.loc[df['消费金额(元)'].idxmax()]
-    biggest_purchase_time = biggest_purchase['交易时间'].strftime('%Y-%m-%d')
-    col3.metric("💸 豪横瞬间", f"¥ {biggest_purchase['消费金额(元)']:.2f}", help=f"在 {biggest_purchase_time} 发生了一笔“巨款”消费！")
+    col3.metric("💸 豪横瞬间", f"¥ {amounts[biggest_idx]:.2f}", help=f"在 {biggest_date} 发生了一笔“巨款”消费！")
 
 
 # --- 主函数与页面渲染 ---
@@ -37,14 +37,19 @@ def main():
         if not os.path.exists(OUTPUT_DIR):
             os.makedirs(OUTPUT_DIR)
 
-        # 数据清洗和转换
-        bill_df['交易金额(元)'] = pd.to_numeric(bill_df['交易金额(元)'], errors='coerce')
-        bill_df['交易时间'] = pd.to_datetime(bill_df['交易时间'], errors='coerce')
-        bill_df.dropna(subset=['交易金额(元)', '交易时间'], inplace=True)
-        
         output_path = os.path.join(OUTPUT_DIR, f'xsyu_bill_{start_date_str}_to_{end_date_str}.xlsx')
-        bill_df.to_excel(output_path, index=False, sheet_name='消费总览')
+        # xlsxwriter 只负责写入，比默认的 openpyxl 更快、更省内存
+        with pd.ExcelWriter(output_path, engine='xlsxwriter') as writer:
+            bill_df.to_excel(writer, index=False, sheet_name='消费总览')
         print(f"\n账单数据已成功保存到：{output_path}")
+
+        # 额外导出 Parquet 文件，便于后续分析快速重新加载；未安装 pyarrow 时跳过
+        parquet_path = os.path.splitext(output_path)[0] + '.parquet'
+        try:
+            bill_df.to_parquet(parquet_path, index=False, compression='zstd')
+            print(f"Parquet 文件已保存到：{parquet_path}")
+        except ImportError:
+            print("未安装 pyarrow，已跳过 Parquet 文件导出。")
     else:
         print("在指定时间范围内没有找到任何消费记录。")
 
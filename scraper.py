@@ -1,12 +1,16 @@
+import asyncio
+import functools
 import json
 import math
 import os
-import time
 from datetime import date
 
+import httpx
+import lxml.html
+import numpy as np
 import pandas as pd
-import requests
-from bs4 import BeautifulSoup
+from lxml import etree
+from pandas.api.types import union_categoricals
 
 # 全局变量
 CONFIG_FILE = 'config.json'
@@ -14,6 +18,31 @@ CONFIG_TEMPLATE = {
     "cookie": "请在这里填入您从浏览器获取的 Cookie",
     "user_agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36"
 }
+BILL_URL = "https://ykt.xsyu.edu.cn/easytong_portal/integrate/bill"
+# 并发抓取分页时同时进行的请求数上限，同时也是连接池大小
+MAX_CONCURRENCY = 8
+# 请求的每页条数；服务器若有上限会按实际条数返回，分页时以页面回显的条数为准
+PAGE_SIZE = 200
+# 服务器返回这些状态码时按指数退避重试；账单查询是只读操作，重试 POST 是安全的
+RETRY_STATUSES = frozenset([500, 502, 503, 504])
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.3
+REQUEST_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36',
+    'Referer': BILL_URL,
+    'Origin': 'https://ykt.xsyu.edu.cn',
+    'Content-Type': 'application/x-www-form-urlencoded'
+}
+
+
+@functools.lru_cache(maxsize=1)
+def _load_config_cached(mtime):
+    """按文件修改时间缓存解析结果，配置文件在磁盘上变化后自动失效。"""
+    with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError:
+            return None
 
 
 def load_config():
@@ -23,40 +52,44 @@ def load_config():
             json.dump(CONFIG_TEMPLATE, f, indent=4, ensure_ascii=False)
         return None
 
-    with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-        try:
-            config = json.load(f)
-        except json.JSONDecodeError:
-            return None
+    config = _load_config_cached(os.path.getmtime(CONFIG_FILE))
+    if config is None:
+        return None
             
     if not config.get('cookie') or config.get('cookie') == CONFIG_TEMPLATE['cookie']:
         return None
 
-    return config
+    # 返回副本，避免调用方修改到缓存中的对象
+    return dict(config)
+
+
+def _build_client(config):
+    """
+    创建异步 HTTP 客户端。所有分页请求共用同一个连接池（支持时复用同一条 HTTP/2 连接），
+    并沿用环境变量中的代理设置。
+    """
+    return httpx.AsyncClient(
+        http2=True,
+        headers={**REQUEST_HEADERS, 'Cookie': config['cookie']},
+        timeout=30,
+        follow_redirects=True,
+        limits=httpx.Limits(max_connections=MAX_CONCURRENCY),
+    )
 
 
-def fetch_bill_data(config, start_date, end_date, page=1):
+async def fetch_bill_data(client, start_date, end_date, page=1):
     """
     获取指定页码的账单数据
 
     Args:
-        config (dict): 配置字典
+        client (httpx.AsyncClient): 由 _build_client 创建的客户端
         start_date (str): 开始日期 (YYYY-MM-DD)
         end_date (str): 结束日期 (YYYY-MM-DD)
         page (int): 页码
 
     Returns:
-        dict: 包含 'soup' (BeautifulSoup 对象) 和 'total_records' (总记录数) 的字典
+        lxml.html.HtmlElement | str | None: 解析后的文档树；Cookie 失效时返回 "Cookie失效"，网络错误时返回 None
     """
-    url = "https://ykt.xsyu.edu.cn/easytong_portal/integrate/bill"
-    headers = {
-        'Cookie': config['cookie'],
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36',
-        'Referer': 'https://ykt.xsyu.edu.cn/easytong_portal/integrate/bill',
-        'Origin': 'https://ykt.xsyu.edu.cn',
-        'Content-Type': 'application/x-www-form-urlencoded'
-    }
-
     payload = {
         'timeInterval': '',
         'typeFlag': '',
@@ -65,109 +98,216 @@ def fetch_bill_data(config, start_date, end_date, page=1):
         'payepId': '',
         'eWalletId': '',
         'cardaccNum': '',
-        'currentPage': page
+        'currentPage': page,
+        'pageSize': PAGE_SIZE
     }
 
     try:
-        response = requests.post(url, headers=headers, data=payload, timeout=30)
+        # 连接/读取出错、超时或服务器返回 5xx 时按指数退避重试
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                response = await client.post(BILL_URL, data=payload)
+            except httpx.TransportError:
+                if attempt == MAX_RETRIES:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                    break
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
         response.raise_for_status()
 
-        if 'login' in response.url or "统一身份认证" in response.text:
+        if 'login' in str(response.url) or "统一身份认证" in response.text:
             return "Cookie失效"
 
-        return BeautifulSoup(response.content, 'html.parser')
+        # 响应头未声明字符集时 lxml 会按 latin-1 解码，这里显式指定编码
+        parser = lxml.html.HTMLParser(encoding=response.charset_encoding or 'utf-8')
+        return lxml.html.fromstring(response.content, parser=parser)
 
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"网络请求出错 (第 {page} 页)：{e}")
         return None
 
 
-def parse_data_to_dataframe(soup):
+# 账单表中单元格数量完整的数据行
+_ROWS_XPATH = '//table[contains(@class, "table-hover")]/tbody/tr[count(td) >= 5]'
+
+
+def _with_fallback(column, node_test):
     """
-    解析 BeautifulSoup 对象，提取当前页的账单数据并转换为 Pandas DataFrame。
+    构造按列取值的 XPath：优先命中第 column 个单元格内第一个匹配 node_test 的后代元素，
+    没有该元素时命中单元格本身，从而保证每行恰好返回一个节点。
     """
-    table = soup.find('table', {'class': 'table-hover'})
-    if not table:
-        return pd.DataFrame(), None, None
+    cell = f'{_ROWS_XPATH}/td[{column}]'
+    return f'{cell}/descendant::{node_test}[1] | {cell}[not(descendant::{node_test})]'
+
+
+# 解析用到的 XPath 在模块加载时一次性编译，避免每页重复编译
+_TIME_CELL_XPATH = etree.XPath(f'{_ROWS_XPATH}/td[2]')
+_UNIT_XPATH = etree.XPath(f'{_ROWS_XPATH}/td[1]')
+_CONTENT_XPATH = etree.XPath(f'{_ROWS_XPATH}/td[3]')
+_AMOUNT_XPATH = etree.XPath(_with_fallback(4, 'strong[contains(@class, "price")]'))
+_STATUS_XPATH = etree.XPath(_with_fallback(5, 'span'))
+_TIME_PART_XPATH = etree.XPath(_with_fallback(2, 'p[contains(@class, "text-muted")]'))
+_TOTAL_COUNT_XPATH = etree.XPath('//input[@id="totalCount"]/@value')
+_LIST_NUM_XPATH = etree.XPath('//li[contains(@class, "list-num")]')
+
+
+def _column_texts(tree, xpath):
+    """按列一次性取出所有行对应单元格的文本。"""
+    return [node.text_content().strip() for node in xpath(tree)]
+
+
+def _parse_amounts(amount_texts):
+    """
+    将金额文本转换为 float64 数组，并返回标记有效行的布尔掩码。
+
+    先整体交给 numpy 在 C 层完成转换，只有出现无法识别的金额时才退回逐个解析。
+    """
+    if not amount_texts:
+        return np.empty(0, dtype=np.float64), np.empty(0, dtype=bool)
 
-    headers = ["使用单位", "交易时间", "交易内容", "交易金额(元)", "状态"]
-    rows = []
-    tbody = table.find('tbody')
-    if not tbody:
+    texts = np.char.replace(np.asarray(amount_texts, dtype=str), ',', '')
+    try:
+        amounts = texts.astype(np.float64)
+        valid = np.ones(len(texts), dtype=bool)
+    except ValueError:
+        amounts = np.full(len(texts), np.nan)
+        valid = np.ones(len(texts), dtype=bool)
+        for i, text in enumerate(texts):
+            try:
+                amounts[i] = float(text)
+            except ValueError:
+                valid[i] = False
+
+    # "nan"、"inf" 等文本也能被 float 接受，这里一并视为无效金额
+    valid &= np.isfinite(amounts)
+    return amounts, valid
+
+
+def parse_data_to_dataframe(tree):
+    """
+    解析 lxml 文档树，提取当前页的账单数据并转换为 Pandas DataFrame。
+
+    每一列都用一条 XPath 在所有行上一次取出，而不是逐行逐格查找；
+    带有回退逻辑的列（如金额优先取 strong.price）用并集表达式保证每行恰好命中一个节点，
+    因此各列结果按文档顺序一一对齐。
+
+    Returns:
+        tuple: (DataFrame, 总记录数字符串, 分页信息文本)，分页信息缺失时对应项为 None
+    """
+    time_cells = _TIME_CELL_XPATH(tree)
+    if not time_cells:
         return pd.DataFrame(), None, None
 
-    for tr in tbody.find_all('tr'):
-        cells = tr.find_all('td')
-        if len(cells) < 5:
-            continue
-
-        unit = cells[0].text.strip()
-        time_cell = cells[1]
-        date_part = time_cell.contents[0].strip()
-        time_part_tag = time_cell.find('p', {'class': 'text-muted'})
-        time_part = time_part_tag.text.strip() if time_part_tag else ''
-        full_time = f"{date_part} {time_part}"
-        content = cells[2].text.strip()
-        amount_tag = cells[3].find('strong', {'class': 'price'})
-        amount = amount_tag.text.strip() if amount_tag else cells[3].text.strip()
-        status_tag = cells[4].find('span')
-        status = status_tag.text.strip() if status_tag else cells[4].text.strip()
-
-        rows.append([unit, full_time, content, amount, status])
-    
+    units = _column_texts(tree, _UNIT_XPATH)
+    contents = _column_texts(tree, _CONTENT_XPATH)
+    amount_texts = _column_texts(tree, _AMOUNT_XPATH)
+    statuses = _column_texts(tree, _STATUS_XPATH)
+    # 缺少 p.text-muted 的行会命中单元格本身，此时时间部分为空
+    time_parts = [
+        node.text_content().strip() if node.tag == 'p' else ''
+        for node in _TIME_PART_XPATH(tree)
+    ]
+    times = [f"{(td.text or '').strip()} {time_part}" for td, time_part in zip(time_cells, time_parts)]
+
+    # 金额在解析时直接转为浮点数，无法识别的行通过掩码剔除，省去之后的 to_numeric 和 dropna
+    amounts, valid = _parse_amounts(amount_texts)
+
     # 提取分页信息
-    total_count_input = soup.find('input', {'id': 'totalCount'})
-    page_size_text = soup.find('li', {'class': 'list-num'})
+    total_count_values = _TOTAL_COUNT_XPATH(tree)
+    page_size_texts = _LIST_NUM_XPATH(tree)
+    total_count = total_count_values[0] if total_count_values else None
+    page_size_text = page_size_texts[0].text_content() if page_size_texts else None
+
+    # 各列必须按行一一对齐，否则说明页面结构与预期不符，放弃解析该页
+    column_lengths = {len(units), len(time_cells), len(time_parts), len(contents), len(amount_texts), len(statuses)}
+    if len(column_lengths) != 1:
+        print(f"警告：账单表格各列行数不一致 {sorted(column_lengths)}，无法解析此页。")
+        return pd.DataFrame(), None, None
 
-    # --- 数据清洗和类型转换 ---
-    # 转换交易时间为 datetime 对象
-    df = pd.DataFrame(rows, columns=['使用单位', '交易时间', '交易内容', '交易金额(元)', '状态'])
+    # 使用单位、交易内容、状态的取值很少，存为分类类型以节省内存
+    df = pd.DataFrame({
+        '使用单位': pd.Categorical(units),
+        '交易时间': pd.to_datetime(times, errors='coerce'),
+        '交易内容': pd.Categorical(contents),
+        '交易金额(元)': amounts,
+        '状态': pd.Categorical(statuses),
+    })
 
-    # 转换交易金额为数值类型，非数值的将变为 NaN
-    df['交易金额(元)'] = pd.to_numeric(df['交易金额(元)'], errors='coerce')
-    
-    # 删除任何因转换失败而产生空值的行
-    df.dropna(subset=['交易时间', '交易金额(元)'], inplace=True)
+    # 金额或交易时间无法识别的行极少出现，仅在存在时才过滤
+    valid &= df['交易时间'].notna().to_numpy()
+    if not valid.all():
+        df = df[valid].reset_index(drop=True)
+
+    # 下游 (main.py / app.py) 依赖这两列的类型，不再重复转换
+    assert df['交易金额(元)'].dtype == np.float64
+    assert df['交易时间'].dtype.kind == 'M'
 
-    return df, total_count_input, page_size_text
+    return df, total_count, page_size_text
 
 
-def get_all_bills(config, start_date, end_date, progress_callback=None):
+def _concat_column(columns):
+    """拼接多页中的同一列，分类列合并类别以保持分类类型。"""
+    if isinstance(columns[0].dtype, pd.CategoricalDtype):
+        return union_categoricals(columns)
+    return np.concatenate([column.to_numpy() for column in columns])
+
+
+def get_all_bills(config, start_date, end_date, progress_callback=None, skip_failed_pages=True):
     """
     获取所有页的账单数据并合并。
+
+    内部在单个事件循环中并发抓取各页，对调用方仍是同步接口。
+    skip_failed_pages 为 False 时，只要有一页（重试后仍）获取失败，就返回错误信息字符串
+    而不是不完整的 DataFrame，适合需要缓存结果的调用方。
     """
+    return asyncio.run(_get_all_bills_async(config, start_date, end_date, progress_callback, skip_failed_pages))
+
+
+async def _get_all_bills_async(config, start_date, end_date, progress_callback, skip_failed_pages):
+    """在整个抓取过程中共用同一个客户端，结束后关闭连接。"""
+    async with _build_client(config) as client:
+        return await _fetch_all_pages(client, start_date, end_date, progress_callback, skip_failed_pages)
+
+
+async def _fetch_all_pages(client, start_date, end_date, progress_callback, skip_failed_pages):
+    """先获取第一页确定总页数，再并发获取其余页并合并。"""
     # 1. 获取第一页并确定总页数
     print("正在获取第 1 页数据...")
     if progress_callback:
         progress_callback(0, "正在获取第 1 页...")
         
-    result = fetch_bill_data(config, start_date, end_date, page=1)
+    result = await fetch_bill_data(client, start_date, end_date, page=1)
     if result is None:
         return None # 网络错误
     if result == "Cookie失效":
         return "Cookie失效"
     
-    soup_page1 = result
-    df_page1, total_count_input, page_size_text = parse_data_to_dataframe(soup_page1)
+    tree_page1 = result
+    df_page1, total_count_str, page_size_text = parse_data_to_dataframe(tree_page1)
 
     if df_page1.empty:
         print("第一页没有查询到任何数据。")
         return pd.DataFrame()
     
-    all_dfs = [df_page1]
-
-    if not total_count_input or not page_size_text:
+    if not total_count_str or not page_size_text:
         print("警告：无法找到分页信息，只返回第一页的结果。")
         return df_page1
 
-    total_count = int(total_count_input.get('value', 0))
+    try:
+        total_count = int(total_count_str)
+    except ValueError:
+        print(f"警告：无法从 '{total_count_str}' 解析总记录数，只返回第一页的结果。")
+        return df_page1
+
+    # 以服务器在分页信息中回显的实际每页条数为准，解析失败时退回服务器默认的 20 条
     page_size = 20
     
     try:
-        page_size_str = page_size_text.text.split(',')[0].split('-')[1].replace('条','').strip()
+        page_size_str = page_size_text.split(',')[0].split('-')[1].replace('条','').strip()
         page_size = int(page_size_str)
     except (ValueError, IndexError):
-        print(f"无法从 '{page_size_text.text}' 解析每页条数，将使用默认值 {page_size}。")
+        print(f"无法从 '{page_size_text}' 解析每页条数，将使用默认值 {page_size}。")
 
     if total_count == 0 or page_size == 0:
         return df_page1
@@ -175,30 +315,52 @@ def get_all_bills(config, start_date, end_date, progress_callback=None):
     total_pages = math.ceil(total_count / page_size)
     print(f"发现总共 {total_count} 条记录，分为 {total_pages} 页。")
 
-    # 2. 循环获取剩余页的数据
+    # 2. 并发获取剩余页的数据，按页码收集结果
+    page_dfs = {1: df_page1}
     if total_pages > 1:
-        for page in range(2, total_pages + 1):
-            if progress_callback:
-                progress_callback(page / total_pages, f"正在获取第 {page}/{total_pages} 页...")
-            
-            print(f"正在获取第 {page} 页数据...")
-            result_page_n = fetch_bill_data(config, start_date, end_date, page=page)
-
-            if result_page_n is None:
-                print(f"获取第 {page} 页失败，将跳过此页。")
-                continue
-            if result_page_n == "Cookie失效":
-                return "Cookie失效"
-            
-            soup_page_n = result_page_n
-            df_page_n, _, _ = parse_data_to_dataframe(soup_page_n)
-            if not df_page_n.empty:
-                all_dfs.append(df_page_n)
-            
-            time.sleep(0.5)
+        semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+
+        async def fetch_page(page):
+            async with semaphore:
+                return page, await fetch_bill_data(client, start_date, end_date, page)
+
+        tasks = [asyncio.create_task(fetch_page(page)) for page in range(2, total_pages + 1)]
+        try:
+            for done, task in enumerate(asyncio.as_completed(tasks), start=2):
+                page, result_page_n = await task
+                if progress_callback:
+                    progress_callback(done / total_pages, f"已获取 {done}/{total_pages} 页...")
+
+                if result_page_n is None:
+                    if not skip_failed_pages:
+                        print(f"获取第 {page} 页失败，放弃本次查询。")
+                        return f"第 {page} 页获取失败，数据不完整，请稍后重试"
+                    print(f"获取第 {page} 页失败，将跳过此页。")
+                    continue
+                if result_page_n == "Cookie失效":
+                    return "Cookie失效"
+
+                print(f"已获取第 {page} 页数据。")
+                tree_page_n = result_page_n
+                df_page_n, _, _ = parse_data_to_dataframe(tree_page_n)
+                if not df_page_n.empty:
+                    page_dfs[page] = df_page_n
+        finally:
+            # 提前返回时取消尚未完成的请求，并等待其结束后再关闭客户端
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
 
     # 3. 合并所有数据
-    final_df = pd.concat(all_dfs, ignore_index=True)
+    # 各页列结构一致，直接按列拼接底层数组并一次性构建结果，跳过 concat 的逐块对齐与复制
+    frames = [page_dfs[page] for page in sorted(page_dfs)]
+    if len(frames) == 1:
+        final_df = frames[0]
+    else:
+        final_df = pd.DataFrame({
+            column: _concat_column([frame[column] for frame in frames])
+            for column in df_page1.columns
+        })
     print(f"所有页面数据获取完毕，共得到 {len(final_df)} 条记录。")
     if progress_callback:
         progress_callback(1, "数据获取完毕！")